@@ -1,5 +1,6 @@
 """An example to convert images of notes of an anatomy and physiology textbook into digital form."""
 
+import asyncio
 import configmate
 import os
 import fire
@@ -7,13 +8,26 @@ import fire
 from papyrusai import converting, models
 
 
-def main(input_folder: os.PathLike, output_folder: os.PathLike) -> None:
+def main(
+    input_folder: os.PathLike,
+    output_folder: os.PathLike,
+    max_concurrency: int = 5,
+    use_cache: bool = False,
+) -> None:
     config = configmate.get_config(
         "config/anatomy.yaml",
         section="AnatomyAndPhysiologyTextbook",
         validation=models.ImageToTextPrompt,
     )
-    converting.run_on_folder(config, input_folder, output_folder)
+    asyncio.run(
+        converting.arun_on_folder(
+            config,
+            input_folder,
+            output_folder,
+            max_concurrency=max_concurrency,
+            use_cache=use_cache,
+        )
+    )
 
 
 if __name__ == "__main__":
@@ -1,9 +1,10 @@
 """An example to convert images of notes of William James' The Principles of Psychology into digital form.
 
 Usage:
-    `poetry run python examples/psychology.py --input_folder [] --output_folder []`
+    `poetry run python examples/psychology.py --input_folder [] --output_folder [] [--max_concurrency 5] [--use_cache]`
 """
 
+import asyncio
 import configmate
 import os
 import fire
@@ -11,13 +12,26 @@ import fire
 from papyrusai import converting, models
 
 
-def main(input_folder: os.PathLike, output_folder: os.PathLike) -> None:
+def main(
+    input_folder: os.PathLike,
+    output_folder: os.PathLike,
+    max_concurrency: int = 5,
+    use_cache: bool = False,
+) -> None:
     config = configmate.get_config(
         "config/psychology.yaml",
         section="ThePrinciplesOfPsychology",
         validation=models.ImageToTextPrompt,
     )
-    converting.run_on_folder(config, input_folder, output_folder)
+    asyncio.run(
+        converting.arun_on_folder(
+            config,
+            input_folder,
+            output_folder,
+            max_concurrency=max_concurrency,
+            use_cache=use_cache,
+        )
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,102 @@
+"""This module contains a persistent cache of extracted text, keyed by image content."""
+
+from typing import Optional
+import asyncio
+import concurrent.futures
+import os
+import sqlite3
+
+try:
+    import xxhash
+
+    def _new_hash():
+        return xxhash.xxh3_128()
+
+except ImportError:  # xxhash is optional; blake2b is slower but always available.
+    import hashlib
+
+    def _new_hash():
+        return hashlib.blake2b(digest_size=16)
+
+
+_CHUNK_SIZE = 1 << 20
+
+
+class ResultCache:
+    """Maps (image bytes, prompt, model, settings) to previously extracted text.
+
+    Renamed or duplicated images, and reruns into a fresh output folder, are
+    served from here instead of paying for another API call."""
+
+    def __init__(self, db_path: os.PathLike) -> None:
+        self._conn = sqlite3.connect(db_path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results"
+            " (key TEXT PRIMARY KEY, text TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def key(image_path: os.PathLike, *parts: str) -> str:
+        digest = _new_hash()
+        with open(image_path, "rb") as f:
+            while chunk := f.read(_CHUNK_SIZE):
+                digest.update(chunk)
+        for part in parts:
+            digest.update(b"\0")
+            digest.update(part.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._conn.execute(
+            "SELECT text FROM results WHERE key = ?", (key,)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def set(self, key: str, text: str) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO results (key, text) VALUES (?, ?)", (key, text)
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> "ResultCache":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class AsyncResultCache:
+    """`ResultCache` for use from an event loop.
+
+    The sqlite connection is opened, queried, committed and closed on one
+    dedicated thread, so lookups and disk flushes never stall the loop."""
+
+    def __init__(self, db_path: os.PathLike) -> None:
+        self._db_path = db_path
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._cache: Optional[ResultCache] = None
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._run(self._cache.get, key)
+
+    async def set(self, key: str, text: str) -> None:
+        await self._run(self._cache.set, key, text)
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, fn, *args
+        )
+
+    async def __aenter__(self) -> "AsyncResultCache":
+        self._cache = await self._run(ResultCache, self._db_path)
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        try:
+            await self._run(self._cache.close)
+        finally:
+            self._executor.shutdown(wait=False)
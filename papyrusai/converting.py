@@ -1,31 +1,271 @@
 """General script to convert a folder of images to a folder of texts."""
 
+from typing import AsyncContextManager, ContextManager, List, Optional, Set, Tuple
+import asyncio
+import concurrent.futures
+import contextlib
 import os
+import aiohttp
 import tqdm
 
-from papyrusai import models, reading, writing
+from papyrusai import caching, models, reading, writing
+
+_IMAGE_SUFFIXES: Tuple[str, ...] = (".jpg", ".jpeg", ".png")
+_CACHE_FILENAME = ".papyrusai_cache.sqlite3"
 
 
 def run_on_folder(
     promptable: models.Promptable,
     input_folder: os.PathLike,
     output_folder: os.PathLike,
+    max_image_dimension: Optional[int] = reading.DEFAULT_MAX_IMAGE_DIMENSION,
+    use_cache: bool = False,
+    cache_path: Optional[os.PathLike] = None,
+    scan_workers: Optional[int] = None,
 ) -> None:
-    os.makedirs(output_folder, exist_ok=True)
-    for path in tqdm.tqdm(sorted(os.listdir(input_folder))):
-        if not path.endswith(("jpg", "png", "jpeg")):
+    """Convert every image in `input_folder` that has no output yet.
+
+    With `use_cache`, results are also cached by image content at `cache_path`
+    (by default `.papyrusai_cache.sqlite3` inside `output_folder`), so renamed or
+    duplicated images cost nothing. Cached text is served even after its output
+    file is deleted, so leave the cache off (or delete it) to retry a bad page.
+    On network filesystems, set `scan_workers` to stat input entries from that
+    many threads instead of one at a time."""
+    existing_outputs = _prepare_output_folder(output_folder)
+    prompt = promptable.prompt()
+    with _open_cache(output_folder, use_cache, cache_path) as cache:
+        for fullpath, output_path in tqdm.tqdm(
+            _pending_jobs(input_folder, output_folder, existing_outputs, scan_workers)
+        ):
+            _convert_image(prompt, fullpath, output_path, max_image_dimension, cache)
+
+
+async def arun_on_folder(
+    promptable: models.Promptable,
+    input_folder: os.PathLike,
+    output_folder: os.PathLike,
+    max_concurrency: int = 5,
+    max_image_dimension: Optional[int] = reading.DEFAULT_MAX_IMAGE_DIMENSION,
+    use_cache: bool = False,
+    cache_path: Optional[os.PathLike] = None,
+    scan_workers: Optional[int] = None,
+) -> None:
+    """Like `run_on_folder`, but keeps up to `max_concurrency` requests in flight
+    over a single pooled HTTP session.
+
+    Image decoding, encoding and output writes run on a thread pool, so the
+    next pages are prepared while earlier ones wait on the API; the result
+    cache, if enabled, gets a thread of its own. A failing image doesn't stop
+    the others; failures are raised together once the run ends."""
+    existing_outputs = _prepare_output_folder(output_folder)
+    jobs = _pending_jobs(input_folder, output_folder, existing_outputs, scan_workers)
+    prompt = promptable.prompt()
+
+    workers = os.cpu_count() or 1
+    queue: asyncio.Queue = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+    failures: List[Tuple[str, Exception]] = []
+    request_slots = asyncio.Semaphore(max_concurrency)
+    connector = aiohttp.TCPConnector(
+        limit=max_concurrency, limit_per_host=max_concurrency, ttl_dns_cache=300
+    )
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async with _aopen_cache(output_folder, use_cache, cache_path) as cache:
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers
+            ) as executor, tqdm.tqdm(total=len(jobs)) as progress:
+
+                async def _worker() -> None:
+                    while True:
+                        try:
+                            image_path, save_path = queue.get_nowait()
+                        except asyncio.QueueEmpty:
+                            return
+                        try:
+                            await _aconvert_image(
+                                session,
+                                prompt,
+                                image_path,
+                                save_path,
+                                max_image_dimension,
+                                cache,
+                                executor,
+                                request_slots,
+                            )
+                        except Exception as e:
+                            failures.append((image_path, e))
+                        progress.update(1)
+
+                # Enough workers to keep every thread busy preparing pages alongside
+                # the in-flight requests, but no more, so that only a bounded number
+                # of encoded images is ever held in memory.
+                n_workers = min(len(jobs), max_concurrency + workers)
+                await asyncio.gather(*(_worker() for _ in range(n_workers)))
+
+    if failures:
+        image_path, error = failures[0]
+        raise RuntimeError(
+            f"Failed to convert {len(failures)} of {len(jobs)} images "
+            f"(first: {image_path})"
+        ) from error
+
+
+def _open_cache(
+    output_folder: os.PathLike, use_cache: bool, cache_path: Optional[os.PathLike]
+) -> ContextManager[Optional[caching.ResultCache]]:
+    if not use_cache:
+        return contextlib.nullcontext()
+    return caching.ResultCache(_resolve_cache_path(output_folder, cache_path))
+
+
+def _aopen_cache(
+    output_folder: os.PathLike, use_cache: bool, cache_path: Optional[os.PathLike]
+) -> AsyncContextManager[Optional[caching.AsyncResultCache]]:
+    if not use_cache:
+        return contextlib.nullcontext()
+    return caching.AsyncResultCache(_resolve_cache_path(output_folder, cache_path))
+
+
+def _resolve_cache_path(
+    output_folder: os.PathLike, cache_path: Optional[os.PathLike]
+) -> os.PathLike:
+    if cache_path is None:
+        return os.path.join(output_folder, _CACHE_FILENAME)
+    return cache_path
+
+
+def _prepare_output_folder(output_folder: os.PathLike) -> Set[str]:
+    """Return the names already in `output_folder`, creating it if missing.
+
+    A folder that had to be created is known to be empty, so it isn't listed."""
+    try:
+        with os.scandir(output_folder) as it:
+            return {entry.name for entry in it}
+    except FileNotFoundError:
+        os.makedirs(output_folder)
+        return set()
+
+
+def _pending_jobs(
+    input_folder: os.PathLike,
+    output_folder: os.PathLike,
+    existing_outputs: Set[str],
+    scan_workers: Optional[int] = None,
+) -> List[Tuple[str, str]]:
+    """Return sorted (image_path, output_path) pairs that have no output yet.
+
+    The input folder is scanned once and checked against `existing_outputs`,
+    which is updated in place with every output name claimed here, so the
+    output folder never needs re-listing."""
+    with os.scandir(input_folder) as it:
+        candidates = sorted(
+            (entry for entry in it if entry.name.lower().endswith(_IMAGE_SUFFIXES)),
+            key=lambda entry: entry.name,
+        )
+    # is_file() is free when the OS reports entry types, but costs a stat per
+    # entry otherwise, which is slow enough on remote mounts to be worth
+    # overlapping.
+    if scan_workers is not None and scan_workers > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=scan_workers) as pool:
+            is_file = list(pool.map(os.DirEntry.is_file, candidates))
+    else:
+        is_file = [entry.is_file() for entry in candidates]
+    jobs = []
+    for entry, entry_is_file in zip(candidates, is_file):
+        if not entry_is_file:
             continue
-        fullpath = os.path.join(input_folder, path)
-        output_fn = f"output_{path.split('.')[0]}.txt"
-        output_path = os.path.join(output_folder, output_fn)
-        if output_fn in os.listdir(output_folder):
+        output_fn = f"output_{entry.name.split('.')[0]}.txt"
+        if output_fn in existing_outputs:
             continue
-        convert_image_from_path(promptable, fullpath, output_path)
+        existing_outputs.add(output_fn)
+        jobs.append((entry.path, os.path.join(output_folder, output_fn)))
+    return jobs
 
 
 def convert_image_from_path(
-    promptable: models.Promptable, image_path: os.PathLike, save_path: os.PathLike
+    promptable: models.Promptable,
+    image_path: os.PathLike,
+    save_path: os.PathLike,
+    max_image_dimension: Optional[int] = reading.DEFAULT_MAX_IMAGE_DIMENSION,
+    cache: Optional[caching.ResultCache] = None,
+) -> None:
+    _convert_image(
+        promptable.prompt(), image_path, save_path, max_image_dimension, cache
+    )
+
+
+async def aconvert_image_from_path(
+    session: aiohttp.ClientSession,
+    promptable: models.Promptable,
+    image_path: os.PathLike,
+    save_path: os.PathLike,
+    max_image_dimension: Optional[int] = reading.DEFAULT_MAX_IMAGE_DIMENSION,
+    cache: Optional[caching.AsyncResultCache] = None,
+) -> None:
+    await _aconvert_image(
+        session, promptable.prompt(), image_path, save_path, max_image_dimension, cache
+    )
+
+
+def _convert_image(
+    prompt: str,
+    image_path: os.PathLike,
+    save_path: os.PathLike,
+    max_image_dimension: Optional[int],
+    cache: Optional[caching.ResultCache],
+) -> None:
+    writer = writing.FileWriter(save_path)
+    key = None
+    if cache is not None:
+        key = _cache_key(image_path, prompt, max_image_dimension)
+        text = cache.get(key)
+        if text is not None:
+            writer.write(text)
+            return
+    reader = reading.GPTImageReader(image_path, prompt, max_image_dimension)
+    text = reader.read()
+    writer.write(text)
+    if cache is not None:
+        cache.set(key, text)
+
+
+async def _aconvert_image(
+    session: aiohttp.ClientSession,
+    prompt: str,
+    image_path: os.PathLike,
+    save_path: os.PathLike,
+    max_image_dimension: Optional[int],
+    cache: Optional[caching.AsyncResultCache],
+    executor: Optional[concurrent.futures.Executor] = None,
+    request_slots: Optional[asyncio.Semaphore] = None,
 ) -> None:
+    loop = asyncio.get_running_loop()
     writer = writing.FileWriter(save_path)
-    reader = reading.GPTImageReader(image_path, promptable.prompt())
-    writer.write(reader.read())
+    key = None
+    if cache is not None:
+        key = await loop.run_in_executor(
+            executor, _cache_key, image_path, prompt, max_image_dimension
+        )
+        text = await cache.get(key)
+        if text is not None:
+            await loop.run_in_executor(executor, writer.write, text)
+            return
+    reader = reading.GPTImageReader(image_path, prompt, max_image_dimension)
+    await loop.run_in_executor(executor, reader.encode)
+    async with request_slots or contextlib.nullcontext():
+        text = await reader.aread(session)
+    await loop.run_in_executor(executor, writer.write, text)
+    if cache is not None:
+        await cache.set(key, text)
+
+
+def _cache_key(
+    image_path: os.PathLike, prompt: str, max_image_dimension: Optional[int]
+) -> str:
+    return caching.ResultCache.key(
+        image_path,
+        prompt,
+        reading.GPTImageReader.MODEL_NAME,
+        str(max_image_dimension),
+    )
@@ -1,36 +1,113 @@
 """This module contains code to read from image / input to an intermediate form."""
 
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import abc
+import asyncio
 import os
+import aiohttp
 import requests
-import base64
+import io
+import math
+import mmap
+import random
+import time
+from PIL import Image, ImageOps
+
+try:
+    import pybase64 as b64
+except ImportError:  # SIMD encoder is optional; stdlib gives identical output.
+    import base64 as b64
+
+try:
+    import orjson
+
+    _dumps = orjson.dumps
+except ImportError:  # orjson is optional; stdlib json is slower on large payloads.
+    import json
+
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+
+_OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
+DEFAULT_MAX_IMAGE_DIMENSION = 2048
+
+_MAX_RETRIES = 5
+_RETRY_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+_BACKOFF_BASE = 0.5
+_BACKOFF_CAP = 30.0
+_CONNECT_TIMEOUT = 5.0
+_READ_TIMEOUT = 60.0
 
 
 class Reader(abc.ABC):
+    __slots__ = ()
+
     @abc.abstractmethod
     def read(self) -> str: ...
 
+    async def aread(self, session: aiohttp.ClientSession) -> str:
+        """Readers without a native async path run `read` on the default executor."""
+        return await asyncio.get_running_loop().run_in_executor(None, self.read)
+
 
 class GPTImageReader(Reader):
-    def __init__(self, path_to_image: os.PathLike, prompt: str) -> None:
+    __slots__ = (
+        "prompt",
+        "_path_to_image",
+        "_max_image_dimension",
+        "_encoded_image",
+    )
+    MODEL_NAME = "gpt-4-vision-preview"
+
+    def __init__(
+        self,
+        path_to_image: os.PathLike,
+        prompt: str,
+        max_image_dimension: Optional[int] = DEFAULT_MAX_IMAGE_DIMENSION,
+    ) -> None:
+        """Images whose longest side exceeds `max_image_dimension` pixels are
+        downscaled before upload; pass None to always send the original.
+
+        The image is not touched until `encode`, `read` or `aread` is called."""
         super().__init__()
         self.prompt = prompt
-        self._encoded_image = self._encode_image(path_to_image)
+        self._path_to_image = path_to_image
+        self._max_image_dimension = max_image_dimension
+        self._encoded_image: Optional[str] = None
+
+    def encode(self) -> None:
+        """Load and encode the image now, e.g. on a worker thread ahead of `aread`."""
+        if self._encoded_image is None:
+            self._encoded_image = self._encode_image(
+                self._path_to_image, self._max_image_dimension
+            )
 
     def read(self) -> str:
-        payload = self._get_payload()
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=self._get_headers(),
-            json=payload,
+        self.encode()
+        return self._parse_response(
+            _post_json_with_retry(
+                _OPENAI_CHAT_URL,
+                headers=self._get_headers(),
+                data=_dumps(self._get_payload()),
+            )
+        )
+
+    async def aread(self, session: aiohttp.ClientSession) -> str:
+        if self._encoded_image is None:
+            await asyncio.get_running_loop().run_in_executor(None, self.encode)
+        return self._parse_response(
+            await _apost_json_with_retry(
+                session,
+                _OPENAI_CHAT_URL,
+                headers=self._get_headers(),
+                data=_dumps(self._get_payload()),
+            )
         )
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
 
     def _get_payload(self) -> Dict[str, Any]:
         return {
-            "model": "gpt-4-vision-preview",
+            "model": self.MODEL_NAME,
             "messages": [
                 {
                     "role": "user",
@@ -48,6 +125,10 @@ class GPTImageReader(Reader):
             "max_tokens": 2048,
         }
 
+    @staticmethod
+    def _parse_response(body: Dict[str, Any]) -> str:
+        return body["choices"][0]["message"]["content"]
+
     @staticmethod
     def _get_headers() -> Dict[str, str]:
         return {
@@ -55,7 +136,101 @@ class GPTImageReader(Reader):
             "Authorization": f"Bearer {os.environ['OPENAI_API_KEY']}",
         }
 
-    @staticmethod
-    def _encode_image(path_to_image: os.PathLike) -> bytes:
+    @classmethod
+    def _encode_image(
+        cls, path_to_image: os.PathLike, max_image_dimension: Optional[int]
+    ) -> str:
+        # An empty file can't be mapped or decoded; fail the page clearly
+        # rather than with whichever of Pillow or mmap happens to trip first.
+        if os.stat(path_to_image).st_size == 0:
+            raise ValueError(f"Image file is empty: {path_to_image}")
+        if max_image_dimension is not None:
+            # Opening only parses the header; pixels are decoded on demand.
+            with Image.open(path_to_image) as image:
+                if max(image.size) > max_image_dimension:
+                    return cls._encode_downscaled(image, max_image_dimension)
+        # Map the file rather than reading it, so the raw bytes never get
+        # their own heap copy next to the encoded one.
         with open(path_to_image, "rb") as f:
-            return base64.b64encode(f.read()).decode("utf-8")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return b64.b64encode(mapped).decode("ascii")
+
+    @staticmethod
+    def _encode_downscaled(image: Image.Image, max_image_dimension: int) -> str:
+        size = (max_image_dimension, max_image_dimension)
+        # Lets libjpeg decode straight at a reduced scale; no-op for other formats.
+        image.draft("RGB", size)
+        # Re-saving drops EXIF, so bake the orientation into the pixels first.
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(size, Image.LANCZOS)
+        if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+            # JPEG has no alpha; flatten onto white so dark ink on a transparent
+            # background doesn't turn into a black page.
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, "white")
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        buffer = io.BytesIO()
+        # Baseline 4:2:0 JPEG is the cheapest encode; the model doesn't need more.
+        image.save(buffer, format="JPEG", quality=90, subsampling=2)
+        return b64.b64encode(buffer.getbuffer()).decode("ascii")
+
+
+def _post_json_with_retry(url: str, **kwargs: Any) -> Dict[str, Any]:
+    """POST and return the JSON body, retrying connection errors, timeouts and
+    transient (429/5xx) responses with jittered exponential backoff. TLS errors
+    are raised immediately."""
+    for attempt in range(_MAX_RETRIES + 1):
+        try:
+            response = requests.post(
+                url, timeout=(_CONNECT_TIMEOUT, _READ_TIMEOUT), **kwargs
+            )
+        except requests.exceptions.SSLError:
+            raise  # Certificate/TLS misconfiguration won't fix itself on retry.
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == _MAX_RETRIES:
+                raise
+            time.sleep(_backoff_delay(attempt))
+            continue
+        if response.status_code not in _RETRY_STATUSES or attempt == _MAX_RETRIES:
+            response.raise_for_status()
+            return response.json()
+        time.sleep(_backoff_delay(attempt, response.headers.get("Retry-After")))
+    raise AssertionError("unreachable")
+
+
+async def _apost_json_with_retry(
+    session: aiohttp.ClientSession, url: str, **kwargs: Any
+) -> Dict[str, Any]:
+    """Async counterpart of `_post_json_with_retry`."""
+    timeout = aiohttp.ClientTimeout(
+        sock_connect=_CONNECT_TIMEOUT, sock_read=_READ_TIMEOUT
+    )
+    for attempt in range(_MAX_RETRIES + 1):
+        retry_after = None
+        try:
+            async with session.post(url, timeout=timeout, **kwargs) as response:
+                if response.status not in _RETRY_STATUSES or attempt == _MAX_RETRIES:
+                    response.raise_for_status()
+                    return await response.json()
+                retry_after = response.headers.get("Retry-After")
+        except aiohttp.ClientSSLError:
+            raise
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if attempt == _MAX_RETRIES:
+                raise
+        await asyncio.sleep(_backoff_delay(attempt, retry_after))
+    raise AssertionError("unreachable")
+
+
+def _backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    if retry_after is not None:
+        try:
+            delay = float(retry_after)
+        except ValueError:  # HTTP-date form; fall back to our own schedule.
+            delay = math.nan
+        if math.isfinite(delay):
+            return min(max(0.0, delay), _BACKOFF_CAP)
+    return random.uniform(0, min(_BACKOFF_CAP, _BACKOFF_BASE * 2**attempt))
@@ -2,18 +2,36 @@
 
 import os
 import abc
+import contextlib
 
 
 class Writer(abc.ABC):
+    __slots__ = ()
+
     @abc.abstractmethod
     def write(self, content: str) -> None: ...
 
 
 class FileWriter(Writer):
+    __slots__ = ("write_path",)
+
     def __init__(self, write_path: os.PathLike) -> None:
         super().__init__()
         self.write_path = write_path
 
     def write(self, content: str) -> None:
-        with open(self.write_path, "w") as f:
+        _atomic_write_text(self.write_path, content)
+
+
+def _atomic_write_text(path: os.PathLike, content: str) -> None:
+    """Write via a temporary sibling and rename, so an interrupted run never
+    leaves a partial file that later runs would mistake for finished output."""
+    tmp_path = f"{os.fspath(path)}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
             f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise